@@ -19,7 +19,6 @@
 #
 
 from gevent import socket
-from ipaddress import IPv4Address
 import json
 import logging
 import struct
@@ -48,9 +47,9 @@ class FirewallClient:
                         if command['action'] == 'reset':
                             message = b'reset'
                         else:
-                            address = IPv4Address(command['ip'])
+                            packed_address = socket.inet_aton(command['ip'])
                             action = b'a' if command['action'] == 'add' else b'r'
-                            message = action + struct.pack('<L', command['player_id']) + address.packed
+                            message = action + struct.pack('<L', command['player_id']) + packed_address
                         sock.sendall(struct.pack('<L', len(message)))
                         sock.sendall(message)
                         sock.shutdown(socket.SHUT_RDWR)
@@ -577,9 +577,10 @@ _message_map = {msg_class.msg_id: msg_class for msg_class in _message_classes}
 
 def parse_message_from_bytes(message_bytes):
     msg_id = struct.unpack('<H', message_bytes[0:2])[0]
-    if msg_id not in _message_map:
+    msg_class = _message_map.get(msg_id)
+    if msg_class is None:
         raise RuntimeError('Invalid message type received: id 0x%04X was not found in _message_map' % msg_id)
-    msg = _message_map[msg_id].from_bytes(message_bytes)
+    msg = msg_class.from_bytes(message_bytes)
     return msg
 
 
@@ -587,7 +588,8 @@ def parse_message_from_string(message_str):
     members = json.loads(message_str)
     if 'msg_id' not in members:
         raise ValueError('Failed to parse message due to missing message id')
-    if members['msg_id'] not in _message_map:
+    msg_class = _message_map.get(members['msg_id'])
+    if msg_class is None:
         raise RuntimeError('Invalid message type received: id 0x%04X was not found in _message_map' % members['msg_id'])
-    msg = _message_map[members['msg_id']].from_dict(members)
+    msg = msg_class.from_dict(members)
     return msg
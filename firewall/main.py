@@ -20,6 +20,7 @@
 
 import configparser
 import gevent
+import gevent.pool
 import gevent.queue
 from gevent.server import StreamServer
 import gevent.subprocess as sp
@@ -27,6 +28,7 @@ import json
 import logging
 import os
 import sys
+import time
 
 from common.geventwrapper import gevent_spawn
 from common.logging import set_up_logging
@@ -37,10 +39,30 @@ from .utils import FirewallUtils
 
 INI_PATH = os.path.join('data', 'shared.ini')
 
+# Commands that arrive within this many seconds of each other are
+# handled together, so that a burst of joins and leaves doesn't turn
+# into one netsh invocation per command.
+BATCH_WINDOW_SECS = 1.0
+
+# Incoming connections wait for room in the queue once this many
+# commands are still waiting to be processed.
+MAX_QUEUED_COMMANDS = 10000
+
+# Connections beyond this many are left in the listen backlog until a
+# handler is free, so that a flood can't pile up greenlets waiting on a
+# full queue.
+MAX_CONCURRENT_CONNECTIONS = 16
+
+# A connection has this many seconds to deliver its command, so that
+# idle connections can't keep the handlers above occupied forever.
+CLIENT_RECEIVE_TIMEOUT_SECS = 5
+
 
 class Rulelist:
-    def __init__(self, ports):
+    def __init__(self, utils, logger, ports):
         self.IPs = set()
+        self.utils = utils
+        self.logger = logger
         self.ports = ports
 
     def has_ip(self, ip):
@@ -60,79 +82,83 @@ class Rulelist:
         else:
             return False
 
+    def remove_all(self):
+        # Once the rules are gone, none of the IPs are on the list anymore
+        self.IPs.clear()
+        self.utils.remove_rules_by_name(self.name)
+
+    def rules_for_ip(self, ip):
+        """ Return the firewall rules that implement this list's entry for ip """
+        raise NotImplementedError('rules_for_ip must be implemented in a subclass of Rulelist')
+
+    def apply_batch(self, added, removed):
+        added = [ip for ip in added if not self.has_ip(ip)]
+        removed = [ip for ip in removed if self.has_ip(ip)]
+        rules_to_add = [rule for ip in added for rule in self.rules_for_ip(ip)]
+        rules_to_remove = [rule for ip in removed for rule in self.rules_for_ip(ip)]
+
+        if self.utils.modify_rules(rules_to_add, rules_to_remove):
+            for ip in added:
+                self.add(ip)
+            for ip in removed:
+                self.remove(ip)
+            return
+
+        # Part of the batch may have been applied, so redo it one IP at a time
+        # with separate netsh calls, whose individual results can be trusted.
+        self.logger.warning('Batch update of %s failed, retrying one IP at a time' % self.name)
+        for ip in removed:
+            # A delete that fails here usually means the batch already removed
+            # the rule. Keeping the IP would make a later add of it a no-op and
+            # lock the player out, so forget it either way. A rule that really
+            # was left behind goes away with the next add and remove of the IP
+            # (netsh deletes every matching rule) or with the next reset.
+            for rule in self.rules_for_ip(ip):
+                self.utils.remove_rule(*rule)
+            self.remove(ip)
+        for ip in added:
+            results = [self.utils.add_rule(*rule) for rule in self.rules_for_ip(ip)]
+            if all(results):
+                self.add(ip)
+            else:
+                # Don't leave any of the IP's rules behind without tracking it
+                for rule in self.rules_for_ip(ip):
+                    self.utils.remove_rule(*rule)
+
 
 class Blacklist(Rulelist):
 
     def __init__(self, utils, logger, ports):
-        super().__init__(ports)
-        self.utils = utils
-        self.logger = logger
+        super().__init__(utils, logger, ports)
         self.name = 'TAserverfirewall-blacklist'
         if self.ports.portOffset:
             self.name += f'_offset{self.ports.portOffset}'
 
-    def remove_all(self):
-        self.utils.remove_rules_by_name(self.name)
-
     def reset(self):
         self.logger.info('Resetting blacklist to initial state')
         self.remove_all()
 
-        args = [
-            'c:\\windows\\system32\\Netsh.exe',
-            'advfirewall',
-            'firewall',
-            'add',
-            'rule',
-            'name="%s"' % self.name,
-            'protocol=tcp',
-            'dir=in',
-            'enable=yes',
-            'profile=any',
-            'localport=%d' % self.ports['client2login'],
-            'action=allow'
-        ]
-        try:
-            sp.check_output(args, text = True)
-        except sp.CalledProcessError as e:
-            self.logger.error('Failed to add initial rule to firewall during reset of blacklist:\n'
-                              '%s' % e.output)
-
-    def add(self, ip):
-        if super().add(ip):
-            self.utils.add_rule(self.name, ip, self.ports['client2login'], 'tcp', 'block')
+        self.utils.add_rule(self.name, 'any', self.ports['client2login'], 'tcp', 'allow')
 
-    def remove(self, ip):
-        if super().remove(ip):
-            self.utils.remove_rule(self.name, ip, self.ports['client2login'], 'tcp', 'block')
+    def rules_for_ip(self, ip):
+        return [(self.name, ip, self.ports['client2login'], 'tcp', 'block')]
 
 
 class Whitelist(Rulelist):
 
     def __init__(self, utils, logger, ports):
-        super().__init__(ports)
-        self.utils = utils
-        self.logger = logger
+        super().__init__(utils, logger, ports)
         self.name = 'TAserverfirewall-whitelist'
         if self.ports.portOffset:
             self.name += f'_offset{self.ports.portOffset}'
-
-    def remove_all(self):
-        self.utils.remove_rules_by_name(self.name)
+        self.game_server_ports = '%d,%d' % (self.ports['gameserver1'], self.ports['gameserver2'])
 
     def reset(self):
         self.logger.info('Resetting whitelist to initial state')
         self.remove_all()
 
-    def add(self, ip):
-        if super().add(ip):
-            for protocol in ('udp', 'tcp'):
-                self.utils.add_rule(self.name, ip, '%d,%d' % (self.ports['gameserver1'], self.ports['gameserver2']), protocol, 'allow')
-
-    def remove(self, ip):
-        if super().remove(ip):
-            for protocol in ('udp', 'tcp'):
-                self.utils.remove_rule(self.name, ip, '%d,%d' % (self.ports['gameserver1'], self.ports['gameserver2']), protocol, 'allow')
+    def rules_for_ip(self, ip):
+        return [(self.name, ip, self.game_server_ports, protocol, 'allow') for protocol in ('udp', 'tcp')]
 
 
 class Firewall:
@@ -164,26 +190,54 @@ class Firewall:
         for program in tribes_ascend_programs:
             self.utils.disable_rules_for_program_name(program)
 
-        self.utils.add_rule(self.name, 'any', self.ports['launcher2login'], 'tcp', 'allow') # for game servers
-        self.utils.add_rule(self.name, 'any', self.ports['restapi'], 'tcp', 'allow') # for REST
-        self.utils.add_rule(self.name, 'any', self.ports['launcherping'], 'udp', 'allow') # for in-game pings
+        self.utils.modify_rules([
+            (self.name, 'any', self.ports['launcher2login'], 'tcp', 'allow'), # for game servers
+            (self.name, 'any', self.ports['restapi'], 'tcp', 'allow'), # for REST
+            (self.name, 'any', self.ports['launcherping'], 'udp', 'allow') # for in-game pings
+        ], [])
         self.whitelist.reset()
         self.blacklist.reset()
 
         while True:
-            command = server_queue.get()
-            thelist = lists[command['list']]
-
-            if command['action'] == 'reset':
-                thelist.reset()
-            elif command['action'] == 'add':
-                ip = command['ip']
-                thelist.add(ip)
-            elif command['action'] == 'remove':
-                ip = command['ip']
-                thelist.remove(ip)
+            for list_name, reset, added, removed in self._next_batch(server_queue):
+                thelist = lists[list_name]
+                if reset:
+                    thelist.reset()
+                thelist.apply_batch(added, removed)
+
+    def _next_batch(self, server_queue):
+        commands = [server_queue.get()]
+        deadline = time.monotonic() + BATCH_WINDOW_SECS
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                commands.append(server_queue.get(timeout=remaining))
+            except gevent.queue.Empty:
+                break
+
+        # Only the last add or remove for an IP matters, and a reset
+        # makes everything that came before it on the same list irrelevant.
+        pending = {}
+        resets = set()
+        for command in commands:
+            list_name = command['list']
+            action = command['action']
+            if action == 'reset':
+                resets.add(list_name)
+                pending[list_name] = {}
+            elif action in ('add', 'remove'):
+                pending.setdefault(list_name, {})[command['ip']] = action
             else:
-                self.logger.error('Invalid action received: %s' % command['action'])
+                self.logger.error('Invalid action received: %s' % action)
+
+        batch = []
+        for list_name, actions in pending.items():
+            added = [ip for ip, action in actions.items() if action == 'add']
+            removed = [ip for ip, action in actions.items() if action == 'remove']
+            batch.append((list_name, list_name in resets, added, removed))
+        return batch
 
 
 def main():
@@ -206,16 +260,23 @@ def main():
               file=sys.stderr)
         return
 
-    server_queue = gevent.queue.Queue()
+    server_queue = gevent.queue.Queue(maxsize=MAX_QUEUED_COMMANDS)
     firewall = Firewall(ports)
     gevent_spawn('firewall.run', firewall.run, server_queue)
 
     def handle_client(socket, address):
-        msg = TcpMessageReader(socket).receive()
+        socket.settimeout(CLIENT_RECEIVE_TIMEOUT_SECS)
+        try:
+            msg = TcpMessageReader(socket).receive()
+        except OSError as e:
+            firewall.logger.warning('Dropping connection from %s:%d without a complete command: %s' %
+                                    (address[0], address[1], e))
+            return
         command = json.loads(msg.decode('utf8'))
         server_queue.put(command)
 
-    server = StreamServer(('127.0.0.1', ports['firewall']), handle_client)
+    server = StreamServer(('127.0.0.1', ports['firewall']), handle_client,
+                          spawn=gevent.pool.Pool(MAX_CONCURRENT_CONNECTIONS))
     try:
         server.serve_forever()
     except KeyboardInterrupt:
@@ -20,6 +20,8 @@
 
 import gevent.subprocess as sp
 
+NETSH_PATH = 'c:\\windows\\system32\\Netsh.exe'
+
 
 class FirewallUtils:
     def __init__(self, logger):
@@ -27,7 +29,7 @@ class FirewallUtils:
 
     def remove_rules_by_name(self, name):
         args = [
-            'c:\\windows\\system32\\Netsh.exe',
+            NETSH_PATH,
             'advfirewall',
             'firewall',
             'delete',
@@ -38,12 +40,8 @@ class FirewallUtils:
         # fail if there are no left-over rules from a previous run.
         sp.call(args, stdout=sp.DEVNULL)
 
-    def remove_rule(self, name, ip, port, protocol, allow_or_block):
-        self.logger.info('remove %sing firewall rule for %s to %s port %s' %
-                         (allow_or_block, ip, protocol, port))
-
-        args = [
-            'c:\\windows\\system32\\Netsh.exe',
+    def _remove_rule_args(self, name, ip, port, protocol):
+        return [
             'advfirewall',
             'firewall',
             'delete',
@@ -55,21 +53,12 @@ class FirewallUtils:
             'localport=%s' % port,
             'remoteip=%s' % ip
         ]
-        try:
-            sp.check_output(args, text = True)
-        except sp.CalledProcessError as e:
-            self.logger.error('Failed to remove rule from firewall:\n%s' % e.output)
-
-    def add_rule(self, name, ip, port, protocol, allow_or_block):
-        self.logger.info('add %sing firewall rule for %s to %s port %s' %
-                         (allow_or_block, ip, protocol, port))
 
+    def _add_rule_args(self, name, ip, port, protocol, allow_or_block):
         if allow_or_block not in ('allow', 'block'):
             raise RuntimeError('Invalid argument provided: %s' % allow_or_block)
 
-
-        args = [
-            'c:\\windows\\system32\\Netsh.exe',
+        return [
             'advfirewall',
             'firewall',
             'add',
@@ -83,14 +72,72 @@ class FirewallUtils:
             'action=%s' % allow_or_block,
             'remoteip=%s' % ip
         ]
+
+    def remove_rule(self, name, ip, port, protocol, allow_or_block):
+        self.logger.info('remove %sing firewall rule for %s to %s port %s' %
+                         (allow_or_block, ip, protocol, port))
+
+        args = [NETSH_PATH] + self._remove_rule_args(name, ip, port, protocol)
+        try:
+            sp.check_output(args, text = True)
+        except sp.CalledProcessError as e:
+            self.logger.error('Failed to remove rule from firewall:\n%s' % e.output)
+            return False
+        return True
+
+    def add_rule(self, name, ip, port, protocol, allow_or_block):
+        self.logger.info('add %sing firewall rule for %s to %s port %s' %
+                         (allow_or_block, ip, protocol, port))
+
+        args = [NETSH_PATH] + self._add_rule_args(name, ip, port, protocol, allow_or_block)
         try:
             sp.check_output(args, text = True)
         except sp.CalledProcessError as e:
             self.logger.error('Failed to add rule to firewall:\n%s' % e.output)
+            return False
+        return True
+
+    def modify_rules(self, rules_to_add, rules_to_remove):
+        """ Add and remove a number of rules with a single invocation of netsh
+
+        Both arguments are lists of (name, ip, port, protocol, allow_or_block)
+        tuples, the same arguments that add_rule and remove_rule take. Returns True only if
+        netsh reported success for every one of the changes.
+        """
+        script_lines = []
+        for name, ip, port, protocol, allow_or_block in rules_to_remove:
+            self.logger.info('remove %sing firewall rule for %s to %s port %s' %
+                             (allow_or_block, ip, protocol, port))
+            script_lines.append(' '.join(self._remove_rule_args(name, ip, port, protocol)))
+        for name, ip, port, protocol, allow_or_block in rules_to_add:
+            self.logger.info('add %sing firewall rule for %s to %s port %s' %
+                             (allow_or_block, ip, protocol, port))
+            script_lines.append(' '.join(self._add_rule_args(name, ip, port, protocol, allow_or_block)))
+
+        if not script_lines:
+            return True
+
+        # The commands are fed to netsh on stdin rather than through a script
+        # file, so that no other process can change them before this elevated
+        # netsh executes them.
+        try:
+            output = sp.check_output([NETSH_PATH], input = '\n'.join(script_lines) + '\n', text = True)
+        except sp.CalledProcessError as e:
+            self.logger.error('Failed to modify rules in firewall:\n%s' % e.output)
+            return False
+
+        # When netsh reads its commands from stdin, its exit code can't be relied
+        # on to say whether each of them succeeded. Every advfirewall command
+        # that succeeds prints 'Ok.', so the batch only counts as applied if
+        # each command did so.
+        if output.count('Ok.') != len(script_lines):
+            self.logger.error('Not all firewall rules could be modified:\n%s' % output)
+            return False
+        return True
 
     def find_tribes_ascend_rules(self):
         args = [
-            'c:\\windows\\system32\\Netsh.exe',
+            NETSH_PATH,
             'advfirewall',
             'firewall',
             'show',
@@ -124,7 +171,7 @@ class FirewallUtils:
 
     def disable_rules_for_program_name(self, programname):
         args = [
-            'c:\\windows\\system32\\Netsh.exe',
+            NETSH_PATH,
             'advfirewall',
             'firewall',
             'set',
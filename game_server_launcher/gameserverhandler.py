@@ -24,12 +24,19 @@ import gevent
 import gevent.subprocess as sp
 import logging
 import os
-import time
 
 from .inject import inject
 from common.errors import FatalError
 from common.geventwrapper import gevent_spawn
 
+_DebugActiveProcess = ctypes.windll.kernel32.DebugActiveProcess
+_DebugActiveProcess.argtypes = [ctypes.wintypes.DWORD]
+_DebugActiveProcess.restype = ctypes.wintypes.BOOL
+
+_DebugActiveProcessStop = ctypes.windll.kernel32.DebugActiveProcessStop
+_DebugActiveProcessStop.argtypes = [ctypes.wintypes.DWORD]
+_DebugActiveProcessStop.restype = ctypes.wintypes.BOOL
+
 
 class ConfigurationError(FatalError):
     def __init__(self, message):
@@ -106,13 +113,21 @@ class GameServerHandler:
 
 
     def wait_until_file_contains_string(self, filename, string, timeout = 0):
+        string_bytes = string.encode('utf8')
+        searched_size = 0
         i = 0
         period = 3
         while not timeout or (i < timeout / period):
             try:
-                with open(filename, 'rt') as f:
-                    if string in f.read():
+                with open(filename, 'rb') as f:
+                    # Only search what was appended since the last attempt, plus enough
+                    # of the old data to find the string if it straddles the boundary.
+                    if os.fstat(f.fileno()).st_size < searched_size:
+                        searched_size = 0
+                    f.seek(max(0, searched_size - len(string_bytes) + 1))
+                    if string_bytes in f.read():
                         return True
+                    searched_size = f.tell()
                     gevent.sleep(period)
             except FileNotFoundError:
                 gevent.sleep(period)
@@ -173,7 +188,7 @@ class GameServerHandler:
         self.logger.info(f'{server}: started process with pid {process.pid}')
 
         # Check if it doesn't exit right away
-        time.sleep(2)
+        gevent.sleep(2)
         ret_code = process.poll()
         if ret_code:
             raise FatalError('The game server process terminated almost immediately with exit code %08X' %
@@ -197,14 +212,14 @@ class GameServerHandler:
 
     def freeze_server_process(self, server):
         pid = self.servers[server].pid
-        if not ctypes.windll.kernel32.DebugActiveProcess(pid):
+        if not _DebugActiveProcess(pid):
             self.logger.error(f'{server}: failed to freeze game server process {pid}')
         else:
             self.logger.info(f'{server}: game server process {pid} frozen')
 
     def unfreeze_server_process(self, server):
         pid = self.servers[server].pid
-        if not ctypes.windll.kernel32.DebugActiveProcessStop(pid):
+        if not _DebugActiveProcessStop(pid):
             self.logger.error(f'{server}: failed to unfreeze game server process {pid}')
         else:
             self.logger.info(f'{server}: game server process {pid} unfrozen')
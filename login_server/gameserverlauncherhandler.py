@@ -18,6 +18,7 @@
 # along with taserver.  If not, see <http://www.gnu.org/licenses/>.
 #
 
+from gevent import socket
 from ipaddress import IPv4Address
 
 from common.connectionhandler import *
@@ -45,6 +46,9 @@ class GameServerLauncherHandler(IncomingConnectionHandler):
         self.ports = ports
 
     def create_connection_instances(self, sock, address):
+        # Messages to the launcher are small and each one is written in a single
+        # send, so there is nothing to gain from Nagle's algorithm delaying them.
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
         reader = GameServerLauncherReader(sock)
         writer = GameServerLauncherWriter(sock)
         peer = GameServer(IPv4Address(address[0]), self.ports)